@@ -1,147 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
-import folium
-from folium.plugins import HeatMap
-from streamlit_folium import st_folium
-from branca.element import Template, MacroElement
+import streamlit.components.v1 as components
+
+from utils import CODE_KEY, file_digest, find_latlon_cols, read_table, load_table
 
 st.set_page_config(page_title="John Snow Cholera Map", layout="wide")
 st.title("John Snow Cholera Map")
 st.markdown("Layer boleh toggle atas peta. Kalau tiada paparan, cuba refresh atau tukar browser.")
 
-# Fungsi auto-detect lat/lon/X/Y coordinate
-def find_latlon_cols(df):
-    cols_lower = [c.lower().replace(" ", "") for c in df.columns]
-    lat = None
-    lon = None
-    for orig, c in zip(df.columns, cols_lower):
-        if c in ("lat", "latitude", "y", "ycoord", "ycoordinate"):
-            lat = orig
-        if c in ("lon", "lng", "long", "longitude", "x", "xcoord", "xcoordinate"):
-            lon = orig
-    return lat, lon
+# Lebih dari ini, default guna cluster untuk death points
+CLUSTER_THRESHOLD = 2000
+
+# cache_data hanya hash source wrapper, bukan utils.py; CODE_KEY (digest utils.py) jadi arg pertama
+# semua cache pembaca supaya ubah kod baca/detect tak pulang hasil lama
+
+# Cache hasil detect ikut nama kolum + 200 row pertama (elak Streamlit hash seluruh DataFrame)
+@st.cache_data(show_spinner=False)
+def _find_cols(code_key: str, col_names: tuple, sample: bytes, _sample_df: pd.DataFrame) -> tuple:
+    return find_latlon_cols(_sample_df)
+
+def detect_latlon_cols(df):
+    sample = df.head(200)
+    return _find_cols(CODE_KEY, tuple(df.columns), sample.to_csv(index=False).encode(), sample)
+
+# Digest upload disimpan dalam session_state ikut (file_id, nama, saiz): rerun dengan fail sama
+# terus guna digest lama tanpa hash semula seluruh bytes. Ganti fail = key baru = hash sekali
+def upload_digest(role, f, data):
+    key = (getattr(f, "file_id", None), f.name, f.size)
+    saved = st.session_state.get(f"{role}_digest")
+    if saved is None or saved[0] != key:
+        saved = (key, file_digest(data))
+        st.session_state[f"{role}_digest"] = saved
+    return saved[1]
+
+# Semua cache di bawah di-key ikut digest fail (dikira sekali per upload), bukan bytes:
+# Streamlit tak perlu hash semula seluruh fail untuk setiap fungsi. Bytes = arg underscore
+
+# 200 row pertama sahaja: cukup untuk detect kolum sebelum baca penuh
+@st.cache_data(show_spinner=False)
+def _load_sample(code_key: str, name: str, digest: str, _data: bytes) -> pd.DataFrame:
+    return read_table(name, _data, nrows=200)
+
+# Baca penuh (hanya kolum yang diguna) + convert/buang NA koordinat dalam satu langkah cache.
+# Key = nama + digest + kolum, jadi rerun dapat DataFrame yang dah bersih
+@st.cache_data(show_spinner=False)
+def _load_df(
+    code_key: str, name: str, digest: str, _data: bytes, usecols: tuple = None, lat=None, lon=None
+) -> pd.DataFrame:
+    return load_table(name, _data, usecols, lat, lon, digest)
+
+# Pump: sample + detect + baca penuh dalam satu langkah (jalan dalam thread berasingan dari death)
+def _load_pump(name, digest, data):
+    p_lat, p_lon = detect_latlon_cols(_load_sample(CODE_KEY, name, digest, data))
+    return p_lat, p_lon, _load_df(CODE_KEY, name, digest, data, None, p_lat, p_lon)
+
+# cache_data hanya hash source fungsi wrapper, bukan map_builder.py (import lazy) atau utils.py.
+# Digest source kedua-dua fail jadi sebahagian key: edit kod peta = key baru, bukan HTML lama
+MAP_CODE_KEY = file_digest(b"".join(
+    Path(__file__).with_name(f).read_bytes() for f in ("map_builder.py", "utils.py")
+))
+
+# Bina peta dan cache HTML siap render. Key = versi kod peta + digest fail + kolum + mode;
+# DataFrame (underscore) tak di-hash oleh Streamlit
+@st.cache_data(show_spinner=False)
+def build_map_html(
+    code_key, death_key, pump_key, d_lat, d_lon, p_lat, p_lon, cluster_deaths, popup_fields, _df_death, _df_pump
+) -> str:
+    # folium/branca (berat) diimport hanya bila peta betul-betul dibina: tajuk dan uploader
+    # keluar dulu, dan sesi tanpa upload (st.stop) tak pernah import
+    from map_builder import build_map
+    return build_map(_df_death, _df_pump, d_lat, d_lon, p_lat, p_lon, cluster_deaths, popup_fields)
+
+# Checkbox + peta dalam satu fragment: toggle cluster rerun bahagian ni sahaja, bukan baca fail,
+# detect kolum dan preview data. Widget fragment tak boleh tulis ke sidebar, jadi checkbox atas peta
+_fragment = getattr(st, "fragment", lambda f: f)
+
+@_fragment
+def render_map(death_key, pump_key, d_lat, d_lon, p_lat, p_lon, popup_fields, df_death, df_pump):
+    cluster_deaths = st.checkbox(
+        "Cluster death points", value=len(df_death) > CLUSTER_THRESHOLD,
+        help="Cluster di browser. Sesuai untuk data besar."
+    )
+    map_html = build_map_html(
+        MAP_CODE_KEY, death_key, pump_key, d_lat, d_lon, p_lat, p_lon, cluster_deaths, popup_fields, df_death, df_pump
+    )
+    # Peta = HTML statik sekali render; tiada state balik ke Python, pan/zoom tak trigger rerun.
+    # st.iframe ganti components.html (deprecated) dalam Streamlit baru
+    if hasattr(st, "iframe"):
+        st.iframe(map_html, width=1000, height=650)
+    else:
+        components.html(map_html, width=1000, height=650, scrolling=False)
 
 # Sidebar upload file
 st.sidebar.header("UPLOAD FILE")
 death_file = st.sidebar.file_uploader("Upload Death CSV (wajib)", type=["csv", "xlsx"])
 pump_file = st.sidebar.file_uploader("Upload Pump CSV (opsyenal)", type=["csv", "xlsx"])
 
-# Baca fail death
+# Baca fail death: sample dulu untuk detect kolum
 if death_file is not None:
-    if death_file.name.endswith(".csv"):
-        df_death = pd.read_csv(death_file)
-    else:
-        df_death = pd.read_excel(death_file)
+    death_bytes = death_file.getvalue()
+    death_key = upload_digest("death", death_file, death_bytes)
+    death_sample = _load_sample(CODE_KEY, death_file.name, death_key, death_bytes)
 else:
     st.info("Sila upload Death CSV di sidebar.")
     st.stop()
 
-# Baca fail pump (kalau ada)
-if pump_file is not None:
-    if pump_file.name.endswith(".csv"):
-        df_pump = pd.read_csv(pump_file)
-    else:
-        df_pump = pd.read_excel(pump_file)
-else:
-    df_pump = None
-
 # Detect kolum lat/lon
-d_lat, d_lon = find_latlon_cols(df_death)
+d_lat, d_lon = detect_latlon_cols(death_sample)
 if not d_lat or not d_lon:
-    st.error(f"Tak jumpa latitude/longitude. Kolum: {', '.join(df_death.columns)}")
+    st.error(f"Tak jumpa latitude/longitude. Kolum: {', '.join(death_sample.columns)}")
     st.stop()
 
-# Convert ke numeric dan buang NA
-df_death[d_lat] = pd.to_numeric(df_death[d_lat], errors="coerce")
-df_death[d_lon] = pd.to_numeric(df_death[d_lon], errors="coerce")
-df_death = df_death.dropna(subset=[d_lat, d_lon])
-
-if df_pump is not None:
-    p_lat, p_lon = find_latlon_cols(df_pump)
-    if p_lat and p_lon:
-        df_pump[p_lat] = pd.to_numeric(df_pump[p_lat], errors="coerce")
-        df_pump[p_lon] = pd.to_numeric(df_pump[p_lon], errors="coerce")
-        df_pump = df_pump.dropna(subset=[p_lat, p_lon])
-
-# Center map ikut mean death
-center_lat = float(df_death[d_lat].mean())
-center_lon = float(df_death[d_lon].mean())
-
-# Folium Map dengan HTTPS Tiles dan Attribution
-m = folium.Map(location=[center_lat, center_lon], zoom_start=16, tiles=None)
-folium.TileLayer(
-    tiles="https://cartodb-basemaps-a.global.ssl.fastly.net/light_all/{z}/{x}/{y}.png",
-    name="Positron (light)", attr="© CartoDB © OpenStreetMap contributors", show=True
-).add_to(m)
-folium.TileLayer(
-    tiles="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
-    name="OpenStreetMap", attr="© OpenStreetMap contributors", show=False
-).add_to(m)
-folium.TileLayer(
-    tiles="https://stamen-tiles.a.ssl.fastly.net/terrain/{z}/{x}/{y}.jpg",
-    name="Stamen Terrain", attr="Map tiles by Stamen Design — © OpenStreetMap contributors",
-    show=False
-).add_to(m)
-
-# Death points
-fg_death = folium.FeatureGroup(name="Deaths (points)", show=True)
-for _, r in df_death.iterrows():
-    popup = "<br>".join([f"<b>{col}</b>: {r[col]}" for col in df_death.columns if col not in (d_lat, d_lon)])
-    folium.CircleMarker(
-        location=[r[d_lat], r[d_lon]], radius=5, color="red", fill=True,
-        popup=folium.Popup(popup, max_width=300)
-    ).add_to(fg_death)
-fg_death.add_to(m)
-
-# Heatmap
-if len(df_death) > 1:
-    HeatMap(df_death[[d_lat, d_lon]].values.tolist(), name="Heatmap (deaths)", radius=10, blur=6).add_to(m)
-
-# Pumps
-if df_pump is not None and p_lat and p_lon:
-    fg_pump = folium.FeatureGroup(name="Pumps", show=True)
-    for _, r in df_pump.iterrows():
-        popup = "<br>".join([f"<b>{col}</b>: {r[col]}" for col in df_pump.columns if col not in (p_lat, p_lon)])
-        folium.Marker(
-            location=[r[p_lat], r[p_lon]],
-            popup=folium.Popup(popup, max_width=300),
-            icon=folium.Icon(color="blue", icon="tint", prefix="fa")
-        ).add_to(fg_pump)
-    fg_pump.add_to(m)
-
-folium.LayerControl(position="topright", collapsed=False).add_to(m)
-
-legend_html = """
-{% macro html(this, kwargs) %}
-<div style="
-    position: absolute; 
-    z-index:9999; 
-    background-color: white;
-    padding: 10px;
-    border-radius: 6px;
-    box-shadow: 0 0 6px rgba(0,0,0,0.3);
-    font-size:12px;
-    right: 30px; top: 90px;">
-<b>Legend</b><br>
-<span style="background:#ff0000;border-radius:50%;display:inline-block;width:12px;height:12px;margin-right:6px;"></span> Death points<br>
-<span style="color:blue; margin-left:2px;">●</span> Pump (blue marker)<br>
-</div>
-{% endmacro %}
-"""
-macro = MacroElement()
-macro._template = Template(legend_html)
-m.get_root().add_child(macro)
-
-# Fit map ke semua death
-bounds = [
-    [df_death[d_lat].min(), df_death[d_lon].min()],
-    [df_death[d_lat].max(), df_death[d_lon].max()]
-]
-m.fit_bounds(bounds, padding=(30, 30))
+# Kolum untuk popup death; kurang kolum = HTML lebih kecil
+death_fields = [c for c in death_sample.columns if c not in (d_lat, d_lon)]
+popup_fields = st.sidebar.multiselect("Popup fields", death_fields, default=death_fields[:5])
+
+# Baca penuh death (hanya lat/lon + popup fields, dah convert dan buang NA) dan pump serentak:
+# parser pyarrow lepas GIL, jadi masa ~ max(death, pump). Thread perlu ScriptRunContext untuk cache
+pump_bytes = pump_file.getvalue() if pump_file is not None else None
+pump_key = upload_digest("pump", pump_file, pump_bytes) if pump_bytes is not None else None
+with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as ex:
+    f_death = ex.submit(
+        _load_df, CODE_KEY, death_file.name, death_key, death_bytes, (d_lat, d_lon, *popup_fields), d_lat, d_lon
+    )
+    f_pump = ex.submit(_load_pump, pump_file.name, pump_key, pump_bytes) if pump_bytes is not None else None
+    df_death = f_death.result()
+    # Detect kolum pump sekali sahaja; overlay guna semula p_lat/p_lon
+    p_lat, p_lon, df_pump = f_pump.result() if f_pump is not None else (None, None, None)
+if df_death.empty:
+    st.error(f"Tiada nilai numeric yang sah dalam kolum {d_lat} / {d_lon}.")
+    st.stop()
 
 # Output peta
 st.subheader("Map preview")
-st_data = st_folium(m, width=1000, height=650)
+render_map(death_key, pump_key, d_lat, d_lon, p_lat, p_lon, tuple(popup_fields), df_death, df_pump)
 with st.expander("Preview death data"):
     st.dataframe(df_death)
 if df_pump is not None:
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+import folium
+from folium.elements import JSCSSMixin
+from folium.plugins import HeatMap, FastMarkerCluster
+from branca.element import MacroElement
+
+from utils import group_by_location, join_by_location, coord_list, build_popups, heatmap_image
+
+# Zoom di mana cluster berhenti dan semua titik dipaparkan
+CLUSTER_MAX_ZOOM = 17
+# Callback FastMarkerCluster: circle merah sama macam layer biasa, popup kalau ada
+DEATH_CLUSTER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 5, color: "red", fill: true});
+    if (row[2]) {
+        marker.bindPopup(row[2], {maxWidth: 300});
+    }
+    return marker;
+}
+"""
+# Warna death point ikut bilangan death di satu lokasi: 1, 2-3, 4-6, 7-10, >10
+DEATH_COUNT_BINS = [0, 1, 3, 6, 10, np.inf]
+DEATH_COUNT_COLORS = ["#fc9272", "#fb6a4a", "#ef3b2c", "#cb181d", "#99000d"]
+# Icon pump: satu template Marker untuk seluruh layer GeoJSON pump (bukan satu Icon per pump)
+PUMP_ICON = {"color": "blue", "icon": "tint", "prefix": "fa"}
+# Lebih dari ini, heatmap dikira di server sebagai satu imej (ImageOverlay), bukan HeatMap JS
+HEATMAP_RASTER_THRESHOLD = 5000
+
+# Basemap: layer pertama dipapar dulu, yang lain boleh pilih dalam LayerControl
+TILE_LAYERS = [
+    {
+        "tiles": "https://cartodb-basemaps-a.global.ssl.fastly.net/light_all/{z}/{x}/{y}.png",
+        "name": "Positron (light)", "attr": "© CartoDB © OpenStreetMap contributors", "show": True,
+    },
+    {
+        "tiles": "https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+        "name": "OpenStreetMap", "attr": "© OpenStreetMap contributors", "show": False,
+    },
+    {
+        "tiles": "https://{s}.basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}.png",
+        "name": "Voyager", "attr": "© CartoDB © OpenStreetMap contributors", "show": False,
+    },
+    {
+        "tiles": "https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}.png",
+        "name": "Dark Matter (dark)", "attr": "© CartoDB © OpenStreetMap contributors", "show": False,
+    },
+]
+
+# Legend (HTML tetap, tiada pemboleh ubah)
+LEGEND_HTML = """
+<div style="
+    position: absolute; 
+    z-index:9999; 
+    background-color: white;
+    padding: 10px;
+    border-radius: 6px;
+    box-shadow: 0 0 6px rgba(0,0,0,0.3);
+    font-size:12px;
+    right: 30px; top: 90px;">
+<b>Legend</b><br>
+<span style="background:#ef3b2c;border-radius:50%;display:inline-block;width:12px;height:12px;margin-right:6px;"></span> Death points (saiz/warna ikut bilangan)<br>
+<span style="color:blue; margin-left:2px;">●</span> Pump (blue marker)<br>
+</div>
+"""
+
+# Plugin Leaflet.TileLayer.PouchDBCached: simpan tile dalam IndexedDB browser,
+# jadi pan/zoom dan session seterusnya tak fetch tile yang sama lagi
+class TileCache(JSCSSMixin, MacroElement):
+    default_js = [
+        ("pouchdb", "https://cdn.jsdelivr.net/npm/pouchdb@7.3.1/dist/pouchdb.min.js"),
+        ("pouchdb_cached", "https://unpkg.com/leaflet.tilelayer.pouchdbcached@1.0.0/L.TileLayer.PouchDBCached.js"),
+    ]
+
+# Satu layer GeoJSON untuk semua titik (death dan pump): FeatureCollection terus dari list koordinat
+# dan popup, bukan satu Marker per row. Style per titik (kalau ada) dibaca dari list ikut feature id;
+# folium kumpul style yang sama dalam satu switch JS, jadi style tak diulang dalam properties
+def render_points(name, lats, lons, popups, marker, styles=None):
+    features = [
+        {
+            "type": "Feature", "id": i, "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"popup": popup}
+        }
+        for i, (lat, lon, popup) in enumerate(zip(lats, lons, popups))
+    ]
+    fg = folium.FeatureGroup(name=name, show=True)
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        marker=marker,
+        style_function=(lambda f: styles[f["id"]]) if styles is not None else None,
+        popup=folium.GeoJsonPopup(fields=["popup"], labels=False, max_width=300)
+    ).add_to(fg)
+    return fg
+
+# Bina peta folium dan pulang HTML siap render
+def build_map(df_death, df_pump, d_lat, d_lon, p_lat, p_lon, cluster_deaths, popup_fields):
+    # Bounds semua death. Mean tak perlu: fit_bounds tentukan view akhir, jadi center = tengah bounds
+    lat_arr, lon_arr = df_death[d_lat].to_numpy(), df_death[d_lon].to_numpy()
+    bounds = [
+        [float(lat_arr.min()), float(lon_arr.min())],
+        [float(lat_arr.max()), float(lon_arr.max())]
+    ]
+    center_lat = (bounds[0][0] + bounds[1][0]) / 2
+    center_lon = (bounds[0][1] + bounds[1][1]) / 2
+
+    # Folium Map dengan HTTPS Tiles dan Attribution. prefer_canvas: semua circle dilukis atas satu
+    # <canvas>, bukan satu node SVG per titik
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=16, tiles=None, prefer_canvas=True)
+    TileCache().add_to(m)
+    for tile in TILE_LAYERS:
+        folium.TileLayer(**tile, use_cache=True, cross_origin=True).add_to(m)
+
+    # Death sama lokasi digabung: satu titik per lokasi + bilangan death (n)
+    loc_df, loc_n, loc_codes = group_by_location(df_death, d_lat, d_lon)
+    loc_lats, loc_lons = coord_list(loc_df[d_lat]), coord_list(loc_df[d_lon])
+
+    # Death points
+    if cluster_deaths:
+        # Cluster ikut row asal supaya kiraan cluster = bilangan death.
+        # Hantar [lat, lon, popup] sahaja, marker dibina oleh callback JS
+        death_popups = build_popups(df_death, popup_fields)
+        cluster_data = [
+            [lat, lon, popup]
+            for lat, lon, popup in zip(coord_list(df_death[d_lat]), coord_list(df_death[d_lon]), death_popups.tolist())
+        ]
+        # Zoom >= CLUSTER_MAX_ZOOM: cluster dibuka, titik dilukis satu-satu (skala ikut viewport)
+        FastMarkerCluster(
+            cluster_data, callback=DEATH_CLUSTER_CALLBACK, name="Deaths (points)",
+            options={"disableClusteringAtZoom": CLUSTER_MAX_ZOOM}
+        ).add_to(m)
+    else:
+        # Saiz (log2) dan warna ikut bilangan death di lokasi tu. Popup = bilangan + field
+        # setiap death di lokasi tu (bukan row pertama sahaja)
+        loc_popups = "<b>Deaths</b>: " + pd.Series(loc_n, index=loc_df.index).astype(str)
+        if popup_fields:
+            row_popups = join_by_location(build_popups(df_death, popup_fields), loc_codes)
+            loc_popups = loc_popups.str.cat(pd.Series(row_popups, index=loc_df.index), sep="<hr>")
+        loc_radius = np.round(5 + 3 * np.log2(loc_n), 1).tolist()
+        loc_color = pd.cut(loc_n, bins=DEATH_COUNT_BINS, labels=DEATH_COUNT_COLORS).astype(str).tolist()
+        loc_style = [{"radius": r, "color": c, "fillColor": c} for r, c in zip(loc_radius, loc_color)]
+        render_points(
+            "Deaths (points)", loc_lats, loc_lons, loc_popups.tolist(),
+            marker=folium.CircleMarker(radius=5, color="red", fill=True, fill_opacity=0.7),
+            styles=loc_style
+        ).add_to(m)
+
+    # Heatmap (berat = bilangan death per lokasi)
+    if len(df_death) > HEATMAP_RASTER_THRESHOLD:
+        # Data besar: satu PNG siap kira, browser tak perlu redraw semua titik setiap pan/zoom
+        heat_img, heat_bounds = heatmap_image(
+            loc_df[d_lat].to_numpy(), loc_df[d_lon].to_numpy(), weights=loc_n
+        )
+        folium.raster_layers.ImageOverlay(
+            heat_img, bounds=heat_bounds, opacity=0.6, mercator_project=True, name="Heatmap (deaths)"
+        ).add_to(m)
+    elif len(df_death) > 1:
+        # Satu array float64 [lat, lon, n] + round 5 decimal (~1 m), satu tolist sahaja:
+        # JSON pendek, tanpa ekor float32 macam 51.51341629028320
+        heat_data = np.column_stack([
+            loc_df[d_lat].to_numpy(dtype=np.float64), loc_df[d_lon].to_numpy(dtype=np.float64), loc_n
+        ]).round(5).tolist()
+        HeatMap(heat_data, name="Heatmap (deaths)", radius=10, blur=6).add_to(m)
+
+    # Pumps
+    if p_lat and p_lon:
+        pump_popups = build_popups(df_pump, [c for c in df_pump.columns if c not in (p_lat, p_lon)])
+        render_points(
+            "Pumps", coord_list(df_pump[p_lat]), coord_list(df_pump[p_lon]), pump_popups.tolist(),
+            marker=folium.Marker(icon=folium.Icon(**PUMP_ICON))
+        ).add_to(m)
+
+    folium.LayerControl(position="topright", collapsed=False).add_to(m)
+
+    # Legend HTML statik terus ke body, tiada template Jinja untuk dirender
+    m.get_root().html.add_child(folium.Element(LEGEND_HTML))
+
+    # Fit map ke semua death
+    m.fit_bounds(bounds, padding=(30, 30))
+
+    return m.get_root().render()
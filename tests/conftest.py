@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Repo root dalam sys.path supaya `import utils` jalan dari mana-mana direktori
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,107 @@
+import io
+
+import pandas as pd
+import pytest
+
+from utils import (
+    build_popups, find_latlon_cols, group_by_location, guess_latlon_by_range, join_by_location, load_table,
+    match_latlon_names, match_latlon_substrings, read_table, read_table_cached
+)
+
+# Header kosong (trailing comma, biasa dari export Excel) dan header berulang
+TRAILING_COMMA_CSV = b"Death,lat,lon,\n1,51.51,-0.137,\n2,51.52,-0.138,\n"
+DUPLICATE_HEADER_CSV = b"a,a,lat,lon\n1,2,51.51,-0.137\n3,4,51.52,-0.138\n"
+
+
+@pytest.mark.parametrize("data", [TRAILING_COMMA_CSV, DUPLICATE_HEADER_CSV])
+def test_full_read_accepts_sample_column_names(data, tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.CACHE_DIR", tmp_path)
+    sample = read_table("deaths.csv", data, nrows=200)
+    lat, lon = find_latlon_cols(sample)
+    assert (lat, lon) == ("lat", "lon")
+    # Semua kolum sample (termasuk "Unnamed: 3" / "a.1") jadi usecols untuk baca penuh
+    df = load_table("deaths.csv", data, tuple(sample.columns), lat, lon)
+    assert df.columns.tolist() == sample.columns.tolist()
+    assert len(df) == 2
+
+
+def test_excel_non_string_header(tmp_path, monkeypatch):
+    pytest.importorskip("openpyxl")
+    monkeypatch.setattr("utils.CACHE_DIR", tmp_path)
+    buf = io.BytesIO()
+    pd.DataFrame({2020: [1, 2], "lat": [51.51, 51.52], "lon": [-0.137, -0.138]}).to_excel(buf, index=False)
+    data = buf.getvalue()
+    sample = read_table("deaths.xlsx", data, nrows=200)
+    assert sample.columns.tolist() == ["2020", "lat", "lon"]
+    df = load_table("deaths.xlsx", data, tuple(sample.columns), "lat", "lon")
+    assert df.columns.tolist() == ["2020", "lat", "lon"]
+    assert len(df) == 2
+
+
+def test_parquet_cache_is_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.CACHE_DIR", tmp_path)
+    monkeypatch.setattr("utils.CACHE_MAX_BYTES", 1)
+    data = b"lat,lon\n51.51,-0.137\n51.52,-0.138\n"
+    # Setiap pilihan kolum = satu entri cache; cap kecil -> hanya entri terbaru kekal
+    for usecols in (None, ("lat",), ("lon",)):
+        read_table_cached("deaths.csv", data, usecols)
+    assert len(list(tmp_path.glob("*.parquet"))) == 1
+
+
+def test_match_latlon_names_exact_alias_priority():
+    assert match_latlon_names(("Lat", "Y", "lon", "x")) == ("Lat", "lon")
+    assert match_latlon_names(("X coordinate", "Y coordinate")) == ("Y coordinate", "X coordinate")
+    assert match_latlon_names(("Lat_DD", "Long_DD")) == (None, None)
+
+
+def test_match_latlon_substrings_lists_all_candidates():
+    assert match_latlon_substrings(("Population", "Lat_DD", "Long_DD")) == (("Population", "Lat_DD"), ("Long_DD",))
+
+
+def test_guess_latlon_by_range_skips_integer_and_text_columns():
+    df = pd.DataFrame({"id": [1, 2, 3], "name": ["a", "b", "c"], "y": [51.51, 51.52, 51.53], "x": [-0.13, -0.14, 120.5]})
+    assert guess_latlon_by_range(df) == ("y", "x")
+    assert guess_latlon_by_range(df[["id", "name"]]) == (None, None)
+
+
+def test_find_latlon_cols_rejects_substring_names_with_bad_values():
+    df = pd.DataFrame({"Population": [1200, 3400], "Lat_DD": [51.51, 51.52], "Long_DD": [-0.13, -0.14]})
+    assert find_latlon_cols(df) == ("Lat_DD", "Long_DD")
+    df = pd.DataFrame({"Salon": ["a", "b"], "lat": [51.51, 51.52], "E": [-0.13, -0.14]})
+    assert find_latlon_cols(df) == ("lat", "E")
+    df = pd.DataFrame({"Salon": ["a", "b"], "lat": [51.51, 51.52]})
+    assert find_latlon_cols(df) == ("lat", None)
+
+
+def test_group_by_location_keeps_every_row_popup():
+    df = pd.DataFrame({
+        "lat": [51.51, 51.52, 51.51], "lon": [-0.13, -0.14, -0.13],
+        "name": ["Ann", "Bob", None], "age": [None, 40, 30],
+    })
+    loc_df, counts, codes = group_by_location(df, "lat", "lon")
+    assert counts.tolist() == [2, 1]
+    assert codes.tolist() == [0, 1, 0]
+    popups = join_by_location(build_popups(df, ["name", "age"]), codes)
+    assert len(popups) == len(loc_df)
+    assert "Ann" in popups[0] and "30" in popups[0]
+    assert "Bob" in popups[1]
+
+
+def test_chunked_csv_goes_through_parquet_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.CACHE_DIR", tmp_path)
+    monkeypatch.setattr("utils.CHUNK_THRESHOLD_BYTES", 10)
+    monkeypatch.setattr("utils.CHUNK_ROWS", 1)
+    data = b"lat,lon,name\n51.51,-0.137,a\nx,-0.138,b\n51.52,-0.139,c\n"
+    df = load_table("deaths.csv", data, ("lat", "lon", "name"), "lat", "lon")
+    assert df["name"].tolist() == ["a", "c"]
+    assert len(list(tmp_path.glob("*.parquet"))) == 1
+    cached = load_table("deaths.csv", data, ("lat", "lon", "name"), "lat", "lon")
+    assert cached.index.tolist() == df.index.tolist()
+    assert cached["name"].tolist() == ["a", "c"]
+
+
+def test_build_popups_escapes_values_and_labels():
+    df = pd.DataFrame({"<i>name</i>": ['<img src=x onerror="alert(1)">', "Tom & Jerry"]})
+    popups = build_popups(df, ["<i>name</i>"]).tolist()
+    assert popups[0] == "<b>&lt;i&gt;name&lt;/i&gt;</b>: &lt;img src=x onerror=&quot;alert(1)&quot;&gt;"
+    assert popups[1] == "<b>&lt;i&gt;name&lt;/i&gt;</b>: Tom &amp; Jerry"
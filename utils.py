@@ -0,0 +1,294 @@
+import hashlib
+import html
+import os
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+# Alias nama kolum (lowercase, tanpa space), ikut keutamaan
+_LAT_NAMES = ("lat", "latitude", "y", "ycoord", "ycoordinate", "y_coord", "y_coordinate")
+_LON_NAMES = ("lon", "lng", "long", "longitude", "x", "xcoord", "xcoordinate", "x_coord", "x_coordinate")
+# Set alias untuk satu intersection dengan nama kolum; rank pilih ikut keutamaan kalau lebih dari satu
+_LAT_SET = frozenset(_LAT_NAMES)
+_LON_SET = frozenset(_LON_NAMES)
+_ALIAS_RANK = {**{n: i for i, n in enumerate(_LAT_NAMES)}, **{n: i for i, n in enumerate(_LON_NAMES)}}
+_LAT_SUBSTR = ("lat",)
+_LON_SUBSTR = ("lon", "lng")
+
+# CSV lebih besar dari ini dibaca ikut chunk supaya RAM puncak ~ satu chunk, bukan seluruh fail
+CHUNK_THRESHOLD_BYTES = 50_000_000
+CHUNK_ROWS = 200_000
+
+# Folder cache Parquet (dikongsi antara session dan restart)
+CACHE_DIR = Path(tempfile.gettempdir()) / "johnsnow-map-cache"
+# Saiz maksimum folder cache; lebih dari ini, fail paling lama tak diguna (mtime) dibuang
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Padan ikut nama kolum sahaja (exact alias); cache ikut tuple nama kolum
+@lru_cache(maxsize=8)
+def match_latlon_names(col_names):
+    # Satu dict {nama lowercase: nama asal}, kemudian intersection set dengan alias
+    lookup = {str(c).lower().replace(" ", ""): c for c in col_names}
+    lat_hits = _LAT_SET.intersection(lookup)
+    lon_hits = _LON_SET.intersection(lookup)
+    lat = lookup[min(lat_hits, key=_ALIAS_RANK.__getitem__)] if lat_hits else None
+    lon = lookup[min(lon_hits, key=_ALIAS_RANK.__getitem__)] if lon_hits else None
+    return lat, lon
+
+# Calon ikut substring nama ("Lat_DD", "my_lng"). Nama sahaja tak cukup ("Population" ada "lat",
+# "Salon" ada "lon"), jadi calon mesti lulus semakan nilai dalam find_latlon_cols
+@lru_cache(maxsize=8)
+def match_latlon_substrings(col_names):
+    lookup = {str(c).lower().replace(" ", ""): c for c in col_names}
+    lat_subs = tuple(orig for c, orig in lookup.items() if any(k in c for k in _LAT_SUBSTR))
+    lon_subs = tuple(orig for c, orig in lookup.items() if any(k in c for k in _LON_SUBSTR))
+    return lat_subs, lon_subs
+
+# Skor julat satu kolum: (fraction |nilai| <= 90, fraction |nilai| <= 180), atau None kalau
+# kolum kebanyakannya kosong/teks, atau kolum integer (ID, kiraan)
+def _range_score(s):
+    arr = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    valid = arr[~np.isnan(arr)]
+    if valid.size == 0 or valid.size < 0.5 * arr.size or np.all(valid == np.round(valid)):
+        return None
+    abs_valid = np.abs(valid)
+    return (abs_valid <= 90).mean(), (abs_valid <= 180).mean()
+
+# Kalau nama kolum tak jumpa, teka ikut julat nilai. Setiap kolum di-parse sekali sahaja,
+# kemudian pilih kolum dengan skor (fraction dalam julat) tertinggi
+def guess_latlon_by_range(df, lat=None, lon=None):
+    scores = {}
+    for c in df.columns:
+        if c in (lat, lon):
+            continue
+        score = _range_score(df[c])
+        if score is not None:
+            scores[c] = score
+    if lat is None:
+        lat = max((c for c in scores if c != lon and scores[c][0] >= 0.9), key=lambda c: scores[c][0], default=None)
+    if lon is None:
+        lon = max((c for c in scores if c != lat and scores[c][1] >= 0.9), key=lambda c: scores[c][1], default=None)
+    return lat, lon
+
+# Calon substring pertama yang nilainya lulus semakan julat yang sama macam guess_latlon_by_range
+def _first_in_range(df, candidates, exclude, axis):
+    for c in candidates:
+        if c != exclude:
+            score = _range_score(df[c])
+            if score is not None and score[axis] >= 0.9:
+                return c
+    return None
+
+# Fungsi auto-detect lat/lon/X/Y coordinate
+def find_latlon_cols(df):
+    lat, lon = match_latlon_names(tuple(df.columns))
+    if lat is None or lon is None:
+        lat_subs, lon_subs = match_latlon_substrings(tuple(df.columns))
+        if lat is None:
+            lat = _first_in_range(df, lat_subs, lon, 0)
+        if lon is None:
+            lon = _first_in_range(df, lon_subs, lat, 1)
+    if lat is None or lon is None:
+        lat, lon = guess_latlon_by_range(df, lat, lon)
+    if lat and lon:
+        # Semak julat nilai sekali guna NumPy; tukar kalau lat/lon terbalik
+        lat_arr = pd.to_numeric(df[lat], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        lon_arr = pd.to_numeric(df[lon], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        lat_arr = lat_arr[~np.isnan(lat_arr)]
+        lon_arr = lon_arr[~np.isnan(lon_arr)]
+        if lat_arr.size and lon_arr.size:
+            lat_in_lat = ((lat_arr >= -90) & (lat_arr <= 90)).mean()
+            lat_in_lon = ((lat_arr >= -180) & (lat_arr <= 180)).mean()
+            lon_in_lat = ((lon_arr >= -90) & (lon_arr <= 90)).mean()
+            lon_in_lon = ((lon_arr >= -180) & (lon_arr <= 180)).mean()
+            if lat_in_lat < 0.5 and lon_in_lat >= 0.5 and lat_in_lon >= 0.5 and lon_in_lon >= 0.5:
+                lat, lon = lon, lat
+    return lat, lon
+
+# Sample dibaca dengan parser C, yang tukar header kosong jadi "Unnamed: N" dan header berulang
+# jadi "a.1"; pyarrow tak buat begitu. Pyarrow hanya selamat kalau header asal = nama parser C
+def _plain_csv_header(data):
+    raw = pd.read_csv(BytesIO(data), header=None, nrows=1, dtype=str).iloc[0]
+    names = pd.read_csv(BytesIO(data), nrows=0).columns
+    return bool(raw.notna().all()) and raw.tolist() == names.tolist()
+
+# Baca CSV/Excel dari bytes. CSV: pyarrow (multithread, kolum Arrow) kalau boleh, pyarrow tak
+# support nrows; fallback ke parser C. Excel: calamine (lebih laju dari openpyxl) kalau ada
+def read_table(name, data, **kwargs):
+    if name.lower().endswith(".csv"):
+        if "nrows" not in kwargs and _plain_csv_header(data):
+            try:
+                return pd.read_csv(BytesIO(data), engine="pyarrow", dtype_backend="pyarrow", **kwargs)
+            except (ImportError, KeyError, TypeError, ValueError):
+                # ArrowKeyError (kolum usecols tiada) ialah KeyError; cuba semula dengan parser C
+                pass
+        return pd.read_csv(BytesIO(data), low_memory=False, **kwargs)
+    # Excel: header boleh bukan string (contoh 2020), jadi read_excel tak terima usecols nama.
+    # Baca semua kolum, tukar nama ke str (sama dalam sample dan baca penuh), pilih kolum selepas baca
+    usecols = kwargs.pop("usecols", None)
+    try:
+        df = pd.read_excel(BytesIO(data), engine="calamine", **kwargs)
+    except (ImportError, ValueError):
+        df = pd.read_excel(BytesIO(data), **kwargs)
+    df.columns = [str(c) for c in df.columns]
+    return df[list(usecols)] if usecols else df
+
+# Hash kandungan fail (blake2b, laju); dikira sekali per upload dan jadi key semua cache
+def file_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Versi kod pembaca = digest source fail ini. Masuk dalam key cache Parquet (folder kekal antara
+# restart) dan cache Streamlit di app.py: ubah read_table/clean_coords = key baru, bukan frame lama
+CODE_KEY = file_digest(Path(__file__).read_bytes())
+
+# Baca penuh melalui cache Parquet atas disk, key = hash kandungan fail + kolum
+def read_table_cached(name, data, usecols=None, digest=None):
+    key = (digest or file_digest(data), os.path.splitext(name)[1].lower(), usecols)
+    return _parquet_cached(key, lambda: read_table(name, data, usecols=list(usecols) if usecols else None))
+
+# Pulang DataFrame dari cache Parquet ikut key, atau panggil parse() dan simpan hasilnya
+def _parquet_cached(key, parse):
+    path = CACHE_DIR / f"{hashlib.blake2b(repr((CODE_KEY, key)).encode(), digest_size=16).hexdigest()}.parquet"
+    if path.exists():
+        try:
+            df = pd.read_parquet(path, engine="pyarrow")
+            # Kemas kini mtime: sweep buang ikut paling lama tak diguna (LRU), bukan paling lama ditulis
+            os.utime(path)
+            return df
+        except (ImportError, OSError, ValueError):
+            pass
+    df = parse()
+    # Tulis ke fail sementara dulu, kemudian rename (elak session lain baca fail separuh siap)
+    tmp = None
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp, engine="pyarrow")
+        os.replace(tmp, path)
+        _sweep_cache(keep=path)
+    except (ImportError, OSError, TypeError, ValueError):
+        # Contoh: nama kolum bukan string atau kolum campur jenis; teruskan tanpa cache
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+    return df
+
+# Buang fail cache paling lama tak diguna sampai jumlah saiz <= CACHE_MAX_BYTES (fail baru kekal)
+def _sweep_cache(keep):
+    entries = []
+    for p in CACHE_DIR.glob("*.parquet"):
+        try:
+            info = p.stat()
+        except OSError:
+            continue
+        entries.append((info.st_mtime, info.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries, key=lambda e: e[0]):
+        if total <= CACHE_MAX_BYTES:
+            break
+        if p == keep:
+            continue
+        try:
+            p.unlink()
+            total -= size
+        except OSError:
+            # Session lain dah buang / sedang baca; abaikan
+            pass
+
+# Kolum dah numeric (parser pyarrow biasanya pulang double[pyarrow]) terus ke float32;
+# to_numeric hanya untuk kolum teks/campur. Null Arrow jadi NaN
+def _coord_array(s):
+    if not pd.api.types.is_numeric_dtype(s):
+        s = pd.to_numeric(s, errors="coerce")
+    return s.to_numpy(dtype=np.float32, na_value=np.nan)
+
+# Convert lat/lon ke float32 dan buang row NA dengan satu mask NumPy (ganti dropna)
+def clean_coords(df, lat, lon):
+    lat_arr = _coord_array(df[lat])
+    lon_arr = _coord_array(df[lon])
+    mask = ~(np.isnan(lat_arr) | np.isnan(lon_arr))
+    df = df.iloc[mask].copy()
+    df[lat] = lat_arr[mask]
+    df[lon] = lon_arr[mask]
+    return df
+
+# CSV besar: parse + convert + buang NA setiap chunk, gabung hanya row yang valid
+def read_csv_chunked(data, lat, lon, usecols=None):
+    reader = pd.read_csv(
+        BytesIO(data), usecols=list(usecols) if usecols else None, chunksize=CHUNK_ROWS, low_memory=False
+    )
+    return pd.concat([clean_coords(chunk, lat, lon) for chunk in reader])
+
+# Baca fail penuh dan (kalau lat/lon diberi) convert koordinat + buang NA
+def load_table(name, data, usecols=None, lat=None, lon=None, digest=None):
+    if not (lat and lon):
+        return read_table_cached(name, data, usecols, digest)
+    if name.lower().endswith(".csv") and len(data) > CHUNK_THRESHOLD_BYTES:
+        # Hasil chunk (dah bersih) pun masuk cache Parquet: restart / session baru tak parse semula
+        key = (digest or file_digest(data), "csv-chunked", usecols, lat, lon)
+        return _parquet_cached(key, lambda: read_csv_chunked(data, lat, lon, usecols))
+    return clean_coords(read_table_cached(name, data, usecols, digest), lat, lon)
+
+# Gabung row yang hampir sama koordinat (bundar 5 decimal ~ 1 m, titik yang Leaflet lukis bertindih):
+# pulang (satu row pertama per lokasi, bilangan row per lokasi, nombor lokasi untuk setiap row).
+# Nombor lokasi ikut urutan row pertama, sama dengan urutan row yang dipulang
+def group_by_location(df, lat, lon, decimals=5):
+    keys = pd.DataFrame({
+        "lat": np.round(df[lat].to_numpy(dtype=np.float64), decimals),
+        "lon": np.round(df[lon].to_numpy(dtype=np.float64), decimals),
+    }, index=df.index)
+    codes = keys.groupby(["lat", "lon"], sort=False).ngroup().to_numpy()
+    first = ~keys.duplicated()
+    return df[first], np.bincount(codes), codes
+
+# Gabung popup semua row di satu lokasi (dipisah <hr>), ikut nombor lokasi dari group_by_location
+def join_by_location(popups, codes, sep="<hr>"):
+    return popups.groupby(codes, sort=True).agg(sep.join).to_numpy()
+
+# Koordinat float32 -> list float dibundarkan (6 decimal ~ 10 cm) supaya JSON dalam HTML pendek
+def coord_list(series, decimals=6):
+    return np.round(series.to_numpy(dtype=np.float64), decimals).tolist()
+
+# Popup HTML untuk semua row sekali gus ikut kolum (vectorized), bukan per row.
+# Prefix label dikira sekali per kolum, kemudian satu str.cat gabung semua kolum.
+# Nilai kosong jadi "" (pandas 3 kekal NaN selepas astype(str), NaN akan padam seluruh popup).
+# Nilai dan label dari fail upload di-escape: popup dipapar sebagai HTML (innerHTML) dalam iframe
+def build_popups(df, cols):
+    if not cols:
+        return pd.Series("", index=df.index)
+    parts = [_escape_html(df[col].astype(str).fillna("")).radd(f"<b>{html.escape(str(col))}</b>: ") for col in cols]
+    return parts[0].str.cat(parts[1:], sep="<br>")
+
+# html.escape versi vectorized untuk Series string (& dulu supaya entiti lain tak di-escape dua kali)
+_HTML_ESCAPES = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;"))
+
+def _escape_html(s):
+    for char, entity in _HTML_ESCAPES:
+        s = s.str.replace(char, entity, regex=False)
+    return s
+
+# Blur Gaussian guna dua convolve 1D (separable), tak perlu scipy
+def _gaussian_blur(img, sigma):
+    radius = max(1, int(3 * sigma))
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(x ** 2) / (2.0 * sigma ** 2))
+    kernel /= kernel.sum()
+    img = np.apply_along_axis(np.convolve, 0, img, kernel, mode="same")
+    return np.apply_along_axis(np.convolve, 1, img, kernel, mode="same")
+
+# Heatmap raster: histogram2d + blur + warna (merah -> kuning), pulang (RGBA float 0-1, bounds).
+# Baris pertama imej = latitude paling utara
+def heatmap_image(lats, lons, weights=None, bins=512, sigma=2.0):
+    hist, lat_edges, lon_edges = np.histogram2d(lats, lons, bins=bins, weights=weights)
+    hist = _gaussian_blur(hist, sigma)
+    norm = np.sqrt(hist / hist.max()) if hist.max() > 0 else hist
+    rgba = np.zeros(hist.shape + (4,))
+    rgba[..., 0] = 1.0
+    rgba[..., 1] = np.clip(2.0 * norm - 1.0, 0.0, 1.0)
+    rgba[..., 3] = np.clip(1.5 * norm, 0.0, 1.0)
+    bounds = [[float(lat_edges[0]), float(lon_edges[0])], [float(lat_edges[-1]), float(lon_edges[-1])]]
+    return np.flipud(rgba), bounds